@@ -1,33 +1,109 @@
+import copy
+import datetime
+import email.utils
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
+from cachetools import TTLCache
 from src.logger import logging
-from requests.exceptions import HTTPError, RequestException
-
-logger = logging.getLogger(__name__)
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def pretty_print_http_error(error_str: str):
-    json_error = json.loads(error_str)
-    error_detail = json_error.get("detail", [])
+logger = logging.getLogger(__name__)
 
-    if isinstance(error_detail, dict) or isinstance(error_detail, list):
-        pretty_details = []
-        for detail in error_detail:
+# Endpoint templates, formatted with %
+_SOURCES = "/sources/"
+_SOURCE = "/sources/%s"
+_SOURCE_BY_EXTERNAL_ID = "/sources/external_id/%s"
+_MEAS_LIST = "/sources/%s/measurements"
+_MEAS_ITEM = "/sources/%s/measurements/%s"
+_MEAS_SCALARS = "/sources/%s/measurements/%s/scalars"
+
+# Retry policy for transient gateway errors, shared by both transports.
+# POST is not retried: a create that succeeded on the server but lost its reply would come back as a 409.
+_RETRY_TOTAL = 3
+_RETRY_BACKOFF_FACTOR = 0.2
+_RETRY_STATUSES = (502, 503, 504)
+_RETRY_METHODS = frozenset(["GET", "PUT", "DELETE"])
+_RETRY_BACKOFF_MAX = 120
+
+
+def _retry_backoff(errors):
+    """Seconds to wait after the given number of consecutive errors, computed like urllib3's Retry."""
+    if errors <= 1:
+        return 0
+    return min(_RETRY_BACKOFF_MAX, _RETRY_BACKOFF_FACTOR * 2 ** (errors - 1))
+
+
+def _retry_after(response):
+    """Seconds requested by the Retry-After header of response, or None if it is missing or malformed."""
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    if value.strip().isdigit():
+        return int(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max(0, retry_at.timestamp() - time.time())
+
+
+def _json_loads(data):
+    """Decodes a JSON document from str or bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj):
+    """Encodes obj as a compact JSON document in bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+
+def _json_dumps_pretty(obj):
+    """Encodes obj as an indented JSON string, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(obj, indent=2)
+
+
+def pretty_print_http_error(error):
+    # Accepts the raw body as str or bytes. Never raises, so formatting a log line cannot replace the HTTPError
+    # with a decode error, e.g. for HTML or empty gateway responses.
+    try:
+        json_error = _json_loads(error)
+        error_detail = json_error.get("detail", [])
+
+        if isinstance(error_detail, list):
             # Ignore 'input'
-            pretty_detail = {
-                "type": detail.get("type", "N/A"),
-                "loc": detail.get("loc", "N/A"),
-                "msg": detail.get("msg", "N/A"),
-                "url": detail.get("url", "N/A"),
-            }
-            pretty_details.append(pretty_detail)
-
-        pretty_detail = json.dumps({"detail": pretty_details}, indent=4)
-    elif isinstance(error_detail, str):
-        pretty_detail = json_error.get("detail")
-    else:
-        pretty_detail = json_error
+            pretty_details = [
+                {
+                    "type": detail.get("type", "N/A"),
+                    "loc": detail.get("loc", "N/A"),
+                    "msg": detail.get("msg", "N/A"),
+                    "url": detail.get("url", "N/A"),
+                }
+                for detail in error_detail
+            ]
+            pretty_detail = _json_dumps_pretty({"detail": pretty_details})
+        elif isinstance(error_detail, str):
+            pretty_detail = json_error.get("detail")
+        else:
+            pretty_detail = json_error
+    except (ValueError, AttributeError):
+        if isinstance(error, bytes):
+            return error.decode("utf-8", errors="replace")
+        return error
 
     # Return pretty JSON
     return pretty_detail
@@ -43,14 +119,174 @@ class MultivizClient:
         The base URL for the MultiViz API.
     api_key : str
         The API key for authenticating requests.
+    transport : str, optional
+        The HTTP library to use, either "requests" (HTTP/1.1, default) or "httpx" (HTTP/2).
+
+    The client keeps its connections open between requests. Use it as a context manager, or call close(), to
+    release them when done:
+
+    >>> with MultivizClient(base_url, api_key) as client:
+    ...     client.get_all_sources()
+
+    Source lookups are cached for up to 60 seconds. Changes made through this client are reflected immediately,
+    changes made elsewhere may take until the cached entry expires to show up.
     """
 
-    def __init__(self, base_url, api_key):
-        self.base_url = base_url
-        self.api_key = api_key
+    def __init__(self, base_url, api_key, transport="requests"):
+        self._api_key = api_key
+        self._set_base_url(base_url)
+
+        if transport == "requests":
+            self._init_requests_session()
+        elif transport == "httpx":
+            self._init_httpx_client()
+        else:
+            raise ValueError(
+                f"Unknown transport '{transport}'. Expected 'requests' or 'httpx'."
+            )
+        self._transport = transport
+
+        # Source metadata lookups, keyed by URL. TTLCache is not thread-safe, so every access holds the lock.
+        # _source_cache_generation is bumped on every invalidation so that lookups in flight at that point are not
+        # stored afterwards.
+        self._source_cache = TTLCache(maxsize=1024, ttl=60)
+        self._source_cache_generation = 0
+        self._source_cache_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        """
+        The base URL for the MultiViz API. Assigning a new URL applies it to the following requests.
+        """
+        return self._base_url
+
+    @base_url.setter
+    def base_url(self, base_url):
+        self._set_base_url(base_url)
+        # Cached sources belong to the previous API
+        with self._source_cache_lock:
+            self._source_cache_generation += 1
+            self._source_cache.clear()
+
+    def _set_base_url(self, base_url):
+        """
+        Stores base_url and builds the full URL templates for every endpoint, so each call is a single % format.
+        """
+        self._base_url = base_url
+        escaped_base_url = base_url.replace("%", "%%")
+        self._sources_url = base_url + _SOURCES
+        self._source_url = escaped_base_url + _SOURCE
+        self._source_by_external_id_url = escaped_base_url + _SOURCE_BY_EXTERNAL_ID
+        self._meas_list_url = escaped_base_url + _MEAS_LIST
+        self._meas_item_url = escaped_base_url + _MEAS_ITEM
+        self._meas_scalars_url = escaped_base_url + _MEAS_SCALARS
+
+    @property
+    def api_key(self):
+        """
+        The API key for authenticating requests. Assigning a new key applies it to the following requests.
+        """
+        return self._api_key
+
+    @api_key.setter
+    def api_key(self, api_key):
+        self._api_key = api_key
+        self._session.headers["X-Vibium-Api-Key"] = api_key
+
+    def _init_requests_session(self):
+        """
+        Sets up a pooled requests session with retries as the HTTP/1.1 transport.
+        """
+        # requests is imported here so that importing this module stays cheap
+        import requests
+        from requests.adapters import HTTPAdapter
+        from requests.exceptions import HTTPError, RequestException
+        from urllib3.util.retry import Retry
+
+        self._HTTPError = HTTPError
+        self._RequestException = RequestException
+
+        # A single session keeps the underlying TCP/TLS connection alive between requests.
+        # Headers are set once here and merged by the session into every request.
+        self._session = requests.Session()
+        self._session.headers["X-Vibium-Api-Key"] = self._api_key
+        self._session.headers["Content-Type"] = "application/json"
+
+        # Pool connections for bulk ingestion and retry transient gateway errors with backoff
+        retry = Retry(
+            total=_RETRY_TOTAL,
+            backoff_factor=_RETRY_BACKOFF_FACTOR,
+            status_forcelist=_RETRY_STATUSES,
+            allowed_methods=_RETRY_METHODS,
+            # Hand the last response back once retries run out, so it is raised as an HTTPError like any other
+            # error status. pretty_print_http_error copes with the non-JSON bodies gateways tend to send.
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=retry)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def _init_httpx_client(self):
+        """
+        Sets up an httpx client as the HTTP/2 transport, multiplexing concurrent requests over one connection.
+        Requires httpx with HTTP/2 support (pip install "httpx[http2]").
+        """
+        import httpx
+
+        self._HTTPError = httpx.HTTPStatusError
+        self._RequestException = httpx.RequestError
+        self._ConnectError = httpx.ConnectError
+
+        # The default transport is kept so that HTTP(S)_PROXY environment variables are honoured, like requests does
+        self._session = httpx.Client(
+            http2=True,
+            headers={
+                "X-Vibium-Api-Key": self._api_key,
+                "Content-Type": "application/json",
+            },
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+            follow_redirects=True,
+        )
+
+    def _httpx_request(self, method, url, params=None, body=None):
+        """
+        Sends a request with the httpx client, retrying failed connection attempts for any method and transient
+        gateway errors for idempotent methods. Like urllib3's Retry, the first retry is immediate, later ones back
+        off exponentially, and a Retry-After header on the response takes precedence over the backoff.
+        """
+        for attempt in range(_RETRY_TOTAL + 1):
+            delay = None
+            try:
+                response = self._session.request(method, url, params=params, content=body)
+            except self._ConnectError:
+                # Nothing reached the server, so even a POST is safe to send again
+                if attempt == _RETRY_TOTAL:
+                    raise
+            else:
+                if (
+                    response.status_code not in _RETRY_STATUSES
+                    or method not in _RETRY_METHODS
+                    or attempt == _RETRY_TOTAL
+                ):
+                    return response
+                delay = _retry_after(response)
+            time.sleep(delay if delay is not None else _retry_backoff(attempt + 1))
+
+    def close(self):
+        """
+        Closes the underlying HTTP session or client and releases its pooled connections.
+        The client should not be used after it has been closed.
+        """
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def _request(
-        self, method, endpoint, params=None, payload=None, ignore_http_statuses=None
+        self, method, url, params=None, payload=None, ignore_http_statuses=None
     ):
         """
         Private method to perform HTTP requests.
@@ -59,8 +295,8 @@ class MultivizClient:
         ----------
         method : str
             The HTTP method to use ('GET', 'POST', 'PUT', 'DELETE').
-        endpoint : str
-            The API endpoint to send the request to.
+        url : str
+            The full URL to send the request to.
         params : dict, optional
             Optional query parameters, by default None.
         payload : dict, optional
@@ -70,46 +306,102 @@ class MultivizClient:
 
         Returns
         -------
-        dict
-            JSON response from the API.
+        dict or None
+            JSON response from the API, or None if the response has no content or its status was ignored.
 
         Raises
         ------
         HTTPError
             If the HTTP request returned an unsuccessful status code.
         """
-        url = f"{self.base_url}{endpoint}"
-        headers = {
-            "X-Vibium-Api-Key": self.api_key,
-            "Content-Type": "application/json",
-        }
-
         if ignore_http_statuses is None:
             ignore_http_statuses = []
 
+        # Serialize up front so large waveform payloads don't go through requests' stdlib json
+        body = _json_dumps(payload) if payload is not None else None
+
         try:
-            response = requests.request(
-                method, url, headers=headers, params=params, json=payload
-            )
+            if self._transport == "httpx":
+                response = self._httpx_request(method, url, params=params, body=body)
+                content = response.content
+            else:
+                response = self._session.request(
+                    method, url, params=params, data=body
+                )
+                content = response.content
 
-            # Check against ignore http statuses
+            # Check against ignore http statuses.
+            # The error body is only decoded when the log record will actually be emitted.
             if response.status_code in ignore_http_statuses:
-                logger.warning(
-                    f"Ignored HTTPError: {response.status_code} - {pretty_print_http_error(response.text)}"
-                )
+                if logger.isEnabledFor(logging.WARNING):
+                    logger.warning(
+                        "Ignored HTTPError: %d - %s",
+                        response.status_code,
+                        pretty_print_http_error(content),
+                    )
                 return None
 
-            response.raise_for_status()
-            return response.json()
-        except HTTPError as exc:
-            logger.error(
-                f"HTTPError: {exc.response.status_code} - {pretty_print_http_error(exc.response.text)}"
-            )
+            # Only error responses go through raise_for_status
+            if response.status_code >= 400:
+                response.raise_for_status()
+
+            # DELETE endpoints may answer with no content, which has nothing to decode
+            if response.status_code == 204 or not content:
+                return None
+            return _json_loads(content)
+        except self._HTTPError as exc:
+            if logger.isEnabledFor(logging.ERROR):
+                logger.error(
+                    "HTTPError: %d - %s",
+                    exc.response.status_code,
+                    pretty_print_http_error(exc.response.content),
+                )
             raise
-        except RequestException as exc:
-            logger.error(f"RequestException: {str(exc)}")
+        except self._RequestException as exc:
+            logger.error("RequestException: %s", exc)
             raise
 
+    def _cached_source(self, url):
+        """
+        Returns a copy of the cached source for url and the current cache generation.
+        The source is None if it is not cached.
+        """
+        with self._source_cache_lock:
+            source = self._source_cache.get(url)
+            generation = self._source_cache_generation
+        # Cached entries are private snapshots, so callers may mutate what they get back
+        return (copy.deepcopy(source) if source is not None else None), generation
+
+    def _cache_source(self, source, generation):
+        """
+        Stores a snapshot of a source under both its source_id and external_id URLs, unless the cache was
+        invalidated after generation was read, as the source may then predate an update or deletion.
+        """
+        if not isinstance(source, dict):
+            return
+        source_id = source.get("source_id")
+        external_id = source.get("external_id")
+        snapshot = copy.deepcopy(source)
+        with self._source_cache_lock:
+            if generation != self._source_cache_generation:
+                return
+            if source_id is not None:
+                self._source_cache[self._source_url % source_id] = snapshot
+            if external_id is not None:
+                self._source_cache[self._source_by_external_id_url % external_id] = snapshot
+
+    def _invalidate_source(self, source_id):
+        """
+        Drops every cached entry for a source, whichever URL it is stored under.
+        Called after an update or deletion has been sent, so no lookup can re-cache the old source.
+        """
+        with self._source_cache_lock:
+            self._source_cache_generation += 1
+            self._source_cache.pop(self._source_url % source_id, None)
+            for url, source in list(self._source_cache.items()):
+                if source.get("source_id") == source_id:
+                    self._source_cache.pop(url, None)
+
     def get_all_sources(self):
         """
         Lists all sources with their source IDs.
@@ -124,8 +416,8 @@ class MultivizClient:
         HTTPError
             If the HTTP request returned an unsuccessful status code.
         """
-        endpoint = "/sources/"
-        return self._request("GET", endpoint)
+        url = self._sources_url
+        return self._request("GET", url)
 
     def create_waveform_source(self, payload, ignore_existing=False):
         """
@@ -149,7 +441,7 @@ class MultivizClient:
         HTTPError
             If the HTTP request returned an unsuccessful status code.
         """
-        endpoint = "/sources/"
+        url = self._sources_url
 
         ignore_http_statuses = None
         if ignore_existing:
@@ -157,14 +449,15 @@ class MultivizClient:
 
         try:
             return self._request(
-                "POST", endpoint, payload=payload
+                "POST", url, payload=payload
             )
-        except HTTPError as exc:
+        except self._HTTPError as exc:
             if exc.response.status_code == 409 and ignore_existing:
+                external_id = payload.get("external_id")
                 logger.info(
-                    f"Source with external_id '{payload.get('external_id')}' already exists. Ignoring as per flag."
+                    f"Source with external_id '{external_id}' already exists. Ignoring as per flag."
                 )
-                return self.get_source_by_external_id(payload.get("external_id"))
+                return self.get_source_by_external_id(external_id)
             else:
                 raise
 
@@ -187,8 +480,12 @@ class MultivizClient:
         HTTPError
             If the HTTP request returned an unsuccessful status code.
         """
-        endpoint = f"/sources/{source_id}"
-        return self._request("GET", endpoint)
+        url = self._source_url % source_id
+        source, generation = self._cached_source(url)
+        if source is None:
+            source = self._request("GET", url)
+            self._cache_source(source, generation)
+        return source
     
     def get_source_by_external_id(self, external_id):
         """
@@ -209,8 +506,12 @@ class MultivizClient:
         HTTPError
             If the HTTP request returned an unsuccessful status code.
         """
-        endpoint = f"/sources/external_id/{external_id}"
-        return self._request("GET", endpoint)
+        url = self._source_by_external_id_url % external_id
+        source, generation = self._cached_source(url)
+        if source is None:
+            source = self._request("GET", url)
+            self._cache_source(source, generation)
+        return source
 
 
     def update_source(self, source_id, payload):
@@ -234,8 +535,11 @@ class MultivizClient:
         HTTPError
             If the HTTP request returned an unsuccessful status code.
         """
-        endpoint = f"/sources/{source_id}"
-        return self._request("PUT", endpoint, payload=payload)
+        url = self._source_url % source_id
+        try:
+            return self._request("PUT", url, payload=payload)
+        finally:
+            self._invalidate_source(source_id)
 
     def delete_source(self, source_id):
         """
@@ -248,16 +552,19 @@ class MultivizClient:
 
         Returns
         -------
-        dict
-            JSON response from the API confirming deletion.
+        dict or None
+            JSON response from the API confirming deletion, or None if the response has no content.
 
         Raises
         ------
         HTTPError
             If the HTTP request returned an unsuccessful status code.
         """
-        endpoint = f"/sources/{source_id}"
-        return self._request("DELETE", endpoint)
+        url = self._source_url % source_id
+        try:
+            return self._request("DELETE", url)
+        finally:
+            self._invalidate_source(source_id)
 
     def get_measurements(self, source_id, offset=0, limit=1000):
         """
@@ -283,9 +590,9 @@ class MultivizClient:
         HTTPError
             If the HTTP request returned an unsuccessful status code.
         """
-        endpoint = f"/sources/{source_id}/measurements"
+        url = self._meas_list_url % source_id
         params = {"offset": offset, "limit": limit}
-        return self._request("GET", endpoint, params=params)
+        return self._request("GET", url, params=params)
 
     def create_waveform_measurement(self, source_id, payload, ignore_existing=False):
         """
@@ -309,16 +616,55 @@ class MultivizClient:
         HTTPError
             If the HTTP request returned an unsuccessful status code.
         """
-        endpoint = f"/sources/{source_id}/measurements"
+        url = self._meas_list_url % source_id
 
         ignore_http_statuses = None
         if ignore_existing:
             ignore_http_statuses = [409]
 
         return self._request(
-            "POST", endpoint, payload=payload, ignore_http_statuses=ignore_http_statuses
+            "POST", url, payload=payload, ignore_http_statuses=ignore_http_statuses
         )
 
+    def create_waveform_measurements_bulk(
+        self, source_id, payloads, ignore_existing=False, max_workers=8
+    ):
+        """
+        Add several measurements to source with source_id concurrently, sharing the pooled connections of the
+        client. Each payload is posted with create_waveform_measurement.
+
+        Parameters
+        ----------
+        source_id : str
+            The ID of the source.
+        payloads : iterable
+            Measurement data to be posted, one item per request.
+        ignore_existing : bool, optional
+            Ignore measurements that already exist, by default False.
+        max_workers : int, optional
+            The maximum number of concurrent requests, by default 8.
+            Values above the connection pool size (32) will not increase throughput.
+
+        Returns
+        -------
+        list
+            JSON responses from the API, in the same order as payloads.
+
+        Raises
+        ------
+        HTTPError
+            If any of the HTTP requests returned an unsuccessful status code.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(
+                executor.map(
+                    lambda payload: self.create_waveform_measurement(
+                        source_id, payload, ignore_existing=ignore_existing
+                    ),
+                    payloads,
+                )
+            )
+
     def get_measurement_by_time(self, source_id, timestamp):
         """
         Retrieves the measurement with timestamp under the source with source_id.
@@ -340,8 +686,8 @@ class MultivizClient:
         HTTPError
             If the HTTP request returned an unsuccessful status code.
         """
-        endpoint = f"/sources/{source_id}/measurements/{timestamp}"
-        return self._request("GET", endpoint)
+        url = self._meas_item_url % (source_id, timestamp)
+        return self._request("GET", url)
 
     def update_measurement_meta(self, source_id, timestamp, payload):
         """
@@ -367,8 +713,8 @@ class MultivizClient:
         HTTPError
             If the HTTP request returned an unsuccessful status code.
         """
-        endpoint = f"/sources/{source_id}/measurements/{timestamp}"
-        return self._request("PUT", endpoint, payload=payload)
+        url = self._meas_item_url % (source_id, timestamp)
+        return self._request("PUT", url, payload=payload)
 
     def update_measurement_scalars(self, source_id, timestamp, scalars):
         """
@@ -393,8 +739,8 @@ class MultivizClient:
         HTTPError
             If the HTTP request returned an unsuccessful status code.
         """
-        endpoint = f"/sources/{source_id}/measurements/{timestamp}/scalars"
-        return self._request("PUT", endpoint, payload=scalars)
+        url = self._meas_scalars_url % (source_id, timestamp)
+        return self._request("PUT", url, payload=scalars)
 
     def delete_measurement(self, source_id, timestamp):
         """
@@ -409,13 +755,13 @@ class MultivizClient:
 
         Returns
         -------
-        dict
-            JSON response from the API confirming deletion.
+        dict or None
+            JSON response from the API confirming deletion, or None if the response has no content.
 
         Raises
         ------
         HTTPError
             If the HTTP request returned an unsuccessful status code.
         """
-        endpoint = f"/sources/{source_id}/measurements/{timestamp}"
-        return self._request("DELETE", endpoint)
+        url = self._meas_item_url % (source_id, timestamp)
+        return self._request("DELETE", url)